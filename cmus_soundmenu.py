@@ -1,4 +1,4 @@
-#!/usr/bin/python
+#!/usr/bin/python3
 
 #
 # Written by Serhii aka Nucleusis
@@ -40,7 +40,7 @@ NoDisplay=false
 MimeType=audio/mpeg; audio/x-mp3; audio/x-mpeg; audio/x-musepack; audio/x-wavpack; application/ogg; audio/x-ogg; audio/aac; audio/aacp; x-content/audio-cdda; application/x-cue;
 
 To use this script you must install some dependencies:
-$ sudo apt-get install python-gi python-dbus python-pil python-mutagen
+$ sudo apt-get install python3-gi python3-dbus python3-pil python3-mutagen
 
 Download the script to a convenient location (e.g. ~/.cmus),
 ensure it is executable.
@@ -53,31 +53,112 @@ SOUNDMENU_ENABLE in SETTINGS section below.
 Replace True to False in order to diasble an option
 """
 
-from __future__ import unicode_literals
-
 import dbus
 import dbus.service
 from dbus.mainloop.glib import DBusGMainLoop
-from gi.repository import GObject
-from subprocess import Popen, PIPE
+from gi.repository import GLib
+from subprocess import run, Popen, DEVNULL
 import base64
+import hashlib
+import html
 import sys
 import os
+import re
 import logging
+import shutil
+from collections import OrderedDict
+from functools import lru_cache
 
 from PIL import Image
 from io import BytesIO
 from mutagen import File
+from mutagen.flac import FLAC, Picture
+from mutagen.id3 import ID3
+from mutagen.mp4 import MP4
+from mutagen.oggvorbis import OggVorbis
 from tempfile import NamedTemporaryFile
 
 from gi.repository import Notify
 
+# turn on the dbus mainloop
+DBusGMainLoop(set_as_default=True)
+
 # --- SETTINGS ---
 NOTIFICATIONS_ENABLE = True     # desktop notifications
 COVER_IMAGE_ENABLE = True
 SOUNDMENU_ENABLE = True         # MPRIS D-Bus service
 # ----------------
 
+# characters replaced by html.escape
+MARKUP_CHARS = re.compile('[&<>"\']')
+
+
+def string_array(value, separator='/'):
+    """splits a multi-valued tag into D-Bus array of strings"""
+    return dbus.Array(value.split(separator), signature='s')
+
+
+@lru_cache(maxsize=256)
+def _encode_uri(uri):
+    """transform URI to ID, memoized per URI"""
+    # Only A-Za-z0-9_ is allowed, which is 63 chars, so we can't use
+    # base64. Luckily, D-Bus does not limit the length of object paths.
+    # Since base32 pads trailing bytes with "=" chars, we need to replace
+    # them with an allowed character such as "_".
+    encoded = base64.b32encode(uri.encode('utf-8')).decode('ascii')
+    return encoded.replace('=', '_')
+
+
+def id3_picture(tags):
+    """returns the first embedded image of ID3 tags"""
+    apics = tags.getall('APIC')
+    if apics:
+        return apics[0].data
+
+
+def flac_picture(audio_file):
+    """returns the first embedded image of FLAC file"""
+    if audio_file.pictures:
+        return audio_file.pictures[0].data
+
+
+def mp4_picture(audio_file):
+    """returns the first embedded image of MP4 file"""
+    covers = audio_file.get('covr')
+    if covers:
+        return bytes(covers[0])
+
+
+def ogg_picture(audio_file):
+    """returns the first embedded image of Ogg Vorbis file"""
+    pictures = audio_file.get('metadata_block_picture')
+    if pictures:
+        return Picture(base64.b64decode(pictures[0])).data
+
+
+def any_picture(audio_file):
+    """returns an embedded APIC image of a file opened by mutagen.File"""
+    if 'APIC' in audio_file:
+        return audio_file.get('APIC').data
+    for key in audio_file.keys():
+        if key.startswith('APIC:'):
+            return audio_file.get(key).data
+
+
+# cmus tag, MPRIS metadata key, conversion of the value
+METADATA_TAGS = (
+    ('album',       'xesam:album',          None),
+    ('albumartist', 'xesam:albumArtist',    string_array),
+    ('artist',      'xesam:artist',         string_array),
+    ('comment',     'xesam:comment',        lambda v: string_array(v, '\n')),
+    ('composer',    'xesam:composer',       string_array),
+    ('date',        'xesam:contentCreated', None),
+    ('discnumber',  'xesam:discNumber',     int),
+    ('genre',       'xesam:genre',          string_array),
+    ('title',       'xesam:title',          None),
+    ('tracknumber', 'xesam:trackNumber',    int),
+)
+
 
 class CmusSoundMenu(dbus.service.Object):
     """
@@ -88,34 +169,105 @@ class CmusSoundMenu(dbus.service.Object):
     """
     DESKTOP_NAME = 'cmus'
     SCRIPT_NAME = DESKTOP_NAME + '.soundmenu'
+    COVER_CACHE_SIZE = 64
+    # format-specific readers parse only the tags of their own format
+    # extension -> (tag reader, picture extractor),
+    # other files are read by mutagen.File and any_picture
+    TAG_READERS = {
+        '.mp3':     (ID3,       id3_picture),
+        '.flac':    (FLAC,      flac_picture),
+        '.m4a':     (MP4,       mp4_picture),
+        '.ogg':     (OggVorbis, ogg_picture),
+    }
+    URI_SCHEMES = dbus.Array([
+        'file',
+        'http',
+        'cue',
+        'cdda',
+        ], signature='s')
+    MIME_TYPES = dbus.Array([
+        'audio/mpeg',
+        'audio/x-mp3',
+        'audio/x-mpeg',
+        'audio/x-musepack',
+        'audio/x-wavpack',
+        'application/ogg',
+        'audio/x-ogg',
+        'audio/aac',
+        'audio/aacp',
+        'x-content/audio-cdda',
+        'application/x-cue',
+        ], signature='s')
+    PLAYBACK_STATUSES = {
+        'playing':  'Playing',
+        'paused':   'Paused',
+        'stopped':  'Stopped'
+    }
+    # cmus status field -> Player property
+    STATUS_PROPERTIES = {
+        'status':           'PlaybackStatus',
+        'continue':         'LoopStatus',
+        'repeat':           'LoopStatus',
+        'repeat_current':   'LoopStatus',
+        'shuffle':          'Shuffle',
+        'vol_left':         'Volume',
+        'vol_right':        'Volume'
+    }
 
     def __init__(self, loop):
         """
         Creates a CmusSoundMenu object.
         Requires a dbus loop to be created before the gtk mainloop,
         typically by calling DBusGMainLoop(set_as_default=True).
-        argument loop - MainLoop from GObject
+        argument loop - MainLoop from GLib
+        raises NameExistsException if another instance owns the bus name
         """
 
         self.loop = loop
+        # the bus name is taken first, so a second instance
+        # leaves before doing anything
+        if SOUNDMENU_ENABLE:
+            bus_str = "org.mpris.MediaPlayer2.%s" % (self.SCRIPT_NAME)
+            bus_name = dbus.service.BusName(bus_str, bus=dbus.SessionBus(),
+                                            do_not_queue=True)
+        self._cmus_remote_path = shutil.which('cmus-remote') or 'cmus-remote'
+        self._pending_commands = []
+        # one notification is updated and shown again on every track
+        self._notification = None
         if NOTIFICATIONS_ENABLE:
             try:
                 Notify.init("cmus_soundmenu")
+                self._notification = Notify.Notification.new("", "", None)
+                self._notification.set_urgency(0)
+                self._notification.set_timeout(3000)
             except Exception as e:
-                logging.debug("cannot init Notify: " + str(e))
-        if COVER_IMAGE_ENABLE:
-            self.tempimage = NamedTemporaryFile()
+                logging.debug("cannot init Notify: %s", e)
+        # created with the first cover image
+        self.tempimage = None
+        # (filepath, mtime) -> encoded thumbnail, most recent last
+        self._cover_cache = OrderedDict()
+        self._cover_digest = None
+        self._property_getters = {
+            'PlaybackStatus':   self.get_PlaybackStatus,
+            'LoopStatus':       self.get_LoopStatus,
+            'Shuffle':          self.get_Shuffle,
+            'Metadata':         self.get_Metadata,
+            'Volume':           self.get_Volume
+        }
+        self._property_setters = {
+            'LoopStatus':   self.set_LoopStatus,
+            'Shuffle':      self.set_Shuffle,
+            'Volume':       self.set_Volume
+        }
         self.status = None
         self.get_status()
         self.show_notification(self.status)
         self._set_init_properties()
         if SOUNDMENU_ENABLE:
-            bus_str = "org.mpris.MediaPlayer2.%s" % (self.SCRIPT_NAME)
-            bus_name = dbus.service.BusName(bus_str, bus=dbus.SessionBus())
             dbus.service.Object.__init__(self, bus_name,
                                          "/org/mpris/MediaPlayer2")
         else:
-            GObject.timeout_add(0, self.quit_script)
+            GLib.timeout_add(0, self.quit_script)
 
     def quit_script(self):
         logging.debug("Quit script")
@@ -125,29 +277,49 @@ class CmusSoundMenu(dbus.service.Object):
         if self.loop.is_running():
             self.loop.quit()
             logging.debug("loop closed")
-        if COVER_IMAGE_ENABLE:
+        if self.tempimage is not None:
             try:
                 self.tempimage.close()
                 logging.debug("tempfile closed")
             except Exception as e:
-                logging.debug("cannot close tempfile: " + str(e))
+                logging.debug("cannot close tempfile: %s", e)
         if NOTIFICATIONS_ENABLE:
             try:
                 Notify.uninit()
             except Exception as e:
-                logging.debug("cannot uninit Notify: " + str(e))
-
-    def cmus_command(self, command):
-        """control cmus via cmus-remote commands"""
-        logging.debug("cmus-remote " + command)
-        process = Popen("cmus-remote " + command,
-                        stdout=PIPE, stderr=PIPE, shell=True)
-        process.wait()
-        stdout, stderr = process.communicate()
-        if len(stderr) > 0:
-            logging.debug("cmus-remote stderr: " + str(stderr))
-            GObject.timeout_add(0, self.quit_script)
-        return stdout.decode('utf-8')
+                logging.debug("cannot uninit Notify: %s", e)
+
+    def cmus_command(self, args):
+        """control cmus via cmus-remote, args - list of its arguments"""
+        logging.debug("cmus-remote %s", args)
+        result = run([self._cmus_remote_path] + args,
+                     capture_output=True)
+        if len(result.stderr) > 0:
+            logging.debug("cmus-remote stderr: %s", result.stderr)
+            GLib.timeout_add(0, self.quit_script)
+        return result.stdout.decode('utf-8')
+
+    def cmus_command_async(self, args):
+        """control cmus via cmus-remote without waiting for it"""
+        logging.debug("cmus-remote %s", args)
+        process = Popen([self._cmus_remote_path] + args,
+                        stdout=DEVNULL, stderr=DEVNULL,
+                        start_new_session=True)
+        if len(self._pending_commands) == 0:
+            GLib.timeout_add(500, self._reap_commands)
+        self._pending_commands.append(process)
+
+    def _reap_commands(self):
+        """collects finished cmus-remote processes"""
+        for process in list(self._pending_commands):
+            returncode = process.poll()
+            if returncode is None:
+                continue
+            self._pending_commands.remove(process)
+            if returncode != 0:
+                logging.debug("cmus-remote exit status: %s", returncode)
+                GLib.timeout_add(0, self.quit_script)
+        return len(self._pending_commands) > 0
 
     def set_status(self, raw_status):
         """sets status inside the script"""
@@ -163,35 +335,50 @@ class CmusSoundMenu(dbus.service.Object):
                           'shuffle',
                           'vol_left',
                           'vol_right')
-            new_status = {}
-            new_status['title'] = ''
-            new_status['file'] = ''
             if self.status is None:
-                for key in obligatory:
-                    new_status[key] = ''
+                new_status = dict.fromkeys(obligatory, '')
             else:
-                for key in obligatory:
-                    new_status[key] = self.status[key]
+                new_status = {key: self.status[key] for key in obligatory}
+            new_status['title'] = ''
+            new_status['file'] = ''
             for line in raw_status.splitlines():
-                key, value = line.split(" ", 1)
-                if key in ("tag", "set"):
-                    value = value.split(" ", 1)
-                    new_status[value[0]] = value[1]
-                else:
-                    new_status[key] = value
+                key, _, value = line.partition(" ")
+                if key == "tag" or key == "set":
+                    key, _, value = value.partition(" ")
+                new_status[key] = value
             new_status['title'] = self.get_title(new_status['title'],
                                                  new_status['file'])
-            cover = self.get_cover(new_status)
-            if cover is not None:
-                new_status['cover'] = cover
+            if self._track_changed(new_status):
+                cover = self.get_cover(new_status)
+                if cover is not None:
+                    new_status['cover'] = cover
+            elif 'cover' in self.status:
+                new_status['cover'] = self.status['cover']
         if self.status is not None:
             self._status_changed(new_status)
         self.status = new_status
-        logging.debug("Status: " + str(self.status))
+        logging.debug("Status: %s", self.status)
+
+    def _track_changed(self, new_status):
+        """checks if the fields shown with the cover image were changed"""
+        if self.status is None:
+            return True
+        for key in ('artist', 'title', 'album', 'file'):
+            if self.status.get(key) != new_status.get(key):
+                return True
+        return False
 
     def get_status(self):
         """takes status from cmus"""
-        self.set_status(self.cmus_command("-Q"))
+        self.set_status(self.cmus_command(['-Q']))
+
+    def sync_status(self):
+        """periodically takes status from cmus unless playback is stopped"""
+        if self.status is not None and self.status['status'] == 'stopped':
+            logging.debug("playback is stopped, synchronization skipped")
+        else:
+            self.get_status()
+        return True
 
     def _set_init_properties(self):
         """set properties after initialization """
@@ -203,25 +390,8 @@ class CmusSoundMenu(dbus.service.Object):
             'HasTrackList':     False,
             'Identity':         self.DESKTOP_NAME,
             'DesktopEntry':     self.DESKTOP_NAME,
-            'SupportedUriSchemes': dbus.Array([
-                dbus.String('file'),
-                dbus.String('http'),
-                dbus.String('cue'),
-                dbus.String('cdda'),
-                ], signature='s'),
-            'SupportedMimeTypes': dbus.Array([
-                dbus.String('audio/mpeg'),
-                dbus.String('audio/x-mp3'),
-                dbus.String('audio/x-mpeg'),
-                dbus.String('audio/x-musepack'),
-                dbus.String('audio/x-wavpack'),
-                dbus.String('application/ogg'),
-                dbus.String('audio/x-ogg'),
-                dbus.String('audio/aac'),
-                dbus.String('audio/aacp'),
-                dbus.String('x-content/audio-cdda'),
-                dbus.String('application/x-cue'),
-                ], signature='s')
+            'SupportedUriSchemes': self.URI_SCHEMES,
+            'SupportedMimeTypes':  self.MIME_TYPES
         }
         player_properties = {
             'PlaybackStatus':   self.get_PlaybackStatus(self.status),
@@ -255,6 +425,9 @@ class CmusSoundMenu(dbus.service.Object):
             'org.mpris.MediaPlayer2.Playlists':    playlists_properties,
             'org.mpris.MediaPlayer2.TrackList':    tracklist_properties
         }
+        # the interfaces polled by sound menu clients
+        self._root_properties = root_properties
+        self._player_properties = player_properties
 
     # --- Properties interface (org.freedesktop.DBus.Properties)
 
@@ -265,6 +438,10 @@ class CmusSoundMenu(dbus.service.Object):
         logging.debug(
             '%s.Get(%s, %s) called',
             dbus.PROPERTIES_IFACE, repr(interface), repr(prop))
+        if interface == 'org.mpris.MediaPlayer2.Player':
+            return self._player_properties[prop]
+        elif interface == 'org.mpris.MediaPlayer2':
+            return self._root_properties[prop]
         return self.properties[interface][prop]
 
     @dbus.service.method(dbus.PROPERTIES_IFACE, in_signature='ssv')
@@ -275,14 +452,10 @@ class CmusSoundMenu(dbus.service.Object):
             dbus.PROPERTIES_IFACE, repr(interface), repr(prop), repr(value))
 
         if interface == 'org.mpris.MediaPlayer2.Player':
-            set_dict = {
-                'LoopStatus':   self.set_LoopStatus,
-                'Shuffle':      self.set_Shuffle,
-                'Volume':       self.set_Volume
-            }
-            if prop in set_dict:
-                set_dict[prop](value)
-        self.get_status()
+            if prop in self._property_setters:
+                applied = self._property_setters[prop](value)
+                if applied is not None:
+                    self.PropertiesChanged(interface, {prop: applied}, [])
 
     @dbus.service.method(dbus.PROPERTIES_IFACE,
                          in_signature='s', out_signature='a{sv}')
@@ -315,37 +488,23 @@ class CmusSoundMenu(dbus.service.Object):
                     'Metadata',
                     'Volume'])
             else:
-                status_dict = {
-                    'status':           'PlaybackStatus',
-                    'continue':         'LoopStatus',
-                    'repeat':           'LoopStatus',
-                    'repeat_current':   'LoopStatus',
-                    'shuffle':          'Shuffle',
-                    'vol_left':         'Volume',
-                    'vol_right':        'Volume',
-                    'artist':           'Metadata',
-                    'title':            'Metadata',
-                    'album':            'Metadata'
-                }
-                for key in status_dict:
+                for key, prop in self.STATUS_PROPERTIES.items():
                     if key in new_status:
                         if key not in self.status:
-                            changed.add(status_dict[key])
+                            changed.add(prop)
                         elif self.status[key] != new_status[key]:
-                            changed.add(status_dict[key])
-        if len(changed) > 0:
-            if 'Metadata' in changed:  # or 'PlaybackStatus' in changed:
+                            changed.add(prop)
+                if self._track_changed(new_status):
+                    changed.add('Metadata')
+        # emits only the values which differ from the last emitted ones
+        new_properties = {}
+        for prop in changed:
+            value = self._property_getters[prop](new_status)
+            if self._player_properties.get(prop) != value:
+                new_properties[prop] = value
+        if len(new_properties) > 0:
+            if 'Metadata' in new_properties:
                 self.show_notification(new_status)
-            prop_dict = {
-                    'PlaybackStatus':   self.get_PlaybackStatus,
-                    'LoopStatus':       self.get_LoopStatus,
-                    'Shuffle':          self.get_Shuffle,
-                    'Metadata':         self.get_Metadata,
-                    'Volume':           self.get_Volume
-            }
-            new_properties = {}
-            for prop in changed:
-                new_properties[prop] = prop_dict[prop](new_status)
             self.PropertiesChanged('org.mpris.MediaPlayer2.Player',
                                    new_properties, [])
 
@@ -366,12 +525,15 @@ class CmusSoundMenu(dbus.service.Object):
     def Quit(self):
         """Causes the media player to stop running"""
         logging.debug('%s.Quit called', 'org.mpris.MediaPlayer2')
-        self.cmus_command("-C q")
-        GObject.timeout_add(0, self.quit_script)
+        self.cmus_command_async(['-C', 'q'])
+        GLib.timeout_add(0, self.quit_script)
 
     @dbus.service.method('org.mpris.MediaPlayer2', in_signature='s')
     def SetStatus(self, arg):
-        """receives status info from another instance of the script"""
+        """
+        receives status info from another instance of the script,
+        the main way to update the status
+        """
         logging.debug("got the status from another instance")
         if len(arg) > 0:
             self.set_status(arg)
@@ -380,24 +542,16 @@ class CmusSoundMenu(dbus.service.Object):
 
     def get_PlaybackStatus(self, new_status):
         """returns the current playback status"""
-        playback_value = 'Stopped'
-        playback_dict = {
-            'playing':  'Playing',
-            'paused':   'Paused',
-            'stopped':  'Stopped'
-        }
-        if new_status is not None and "status" in new_status:
-            if new_status['status'] in playback_dict:
-                playback_value = playback_dict[new_status['status']]
-        return playback_value
+        if new_status is None:
+            return 'Stopped'
+        return self.PLAYBACK_STATUSES.get(new_status.get('status'), 'Stopped')
 
     def get_LoopStatus(self, new_status):
         """returns the current loop / repeat status"""
         if new_status is None:
             return ''
-        if all(('continue' in new_status,
-                'repeat' in new_status,
-                'repeat_current')):
+        if all(key in new_status
+               for key in ('continue', 'repeat', 'repeat_current')):
             if new_status['continue'] == 'false':
                 return 'None'
             elif new_status['continue'] == 'true':
@@ -413,40 +567,20 @@ class CmusSoundMenu(dbus.service.Object):
         """returns the metadata of the current element"""
         if new_status is None:
             return ''
-        metadata = {'mpris:trackid': self.get_track_id(new_status['file'])}
+        metadata = dbus.Dictionary(signature='sv')
+        metadata['mpris:trackid'] = self.get_track_id(new_status['file'])
         if 'duration' in new_status and new_status['duration'] != '':
             metadata['mpris:length'] = dbus.Int64(
                                         int(new_status['duration'])*1000)
         if 'cover' in new_status and new_status['cover'] != '':
             metadata['mpris:artUrl'] = self.get_url(new_status['cover'])
-        if 'album' in new_status and new_status['album'] != '':
-            metadata['xesam:album'] = new_status['album']
-        if 'albumartist' in new_status and new_status['albumartist'] != '':
-            metadata['xesam:albumArtist'] = dbus.Array(
-                new_status['albumartist'].split('/'), signature='s')
-        if 'artist' in new_status and new_status['artist'] != '':
-            metadata['xesam:artist'] = dbus.Array(
-                new_status['artist'].split('/'), signature='s')
-        if 'comment' in new_status and new_status['comment'] != '':
-            metadata['xesam:comment'] = dbus.Array(
-                new_status['comment'].split('\n'), signature='s')
-        if 'composer' in new_status and new_status['composer'] != '':
-            metadata['xesam:composer'] = dbus.Array(
-                new_status['composer'].split('/'), signature='s')
-        if 'date' in new_status and new_status['date'] != '':
-            metadata['xesam:contentCreated'] = new_status['date']
-        if 'discnumber' in new_status and new_status['discnumber'] != '':
-            metadata['xesam:discNumber'] = int(new_status['discnumber'])
-        if 'genre' in new_status and new_status['genre'] != '':
-            metadata['xesam:genre'] = dbus.Array(
-                new_status['genre'].split('/'), signature='s')
-        if 'title' in new_status and new_status['title'] != '':
-            metadata['xesam:title'] = new_status['title']
-        if 'tracknumber' in new_status and new_status['tracknumber'] != '':
-            metadata['xesam:trackNumber'] = int(new_status['tracknumber'])
+        for key, tag, transform in METADATA_TAGS:
+            value = new_status.get(key)
+            if value:
+                metadata[tag] = transform(value) if transform else value
         if 'file' in new_status and new_status['file'] != '':
             metadata['xesam:url'] = self.get_url(new_status['file'])
-        return dbus.Dictionary(metadata, signature='sv')
+        return metadata
 
     def get_Shuffle(self, new_status):
         """
@@ -455,9 +589,7 @@ class CmusSoundMenu(dbus.service.Object):
         """
         if new_status is None:
             return False
-        if 'shuffle' in new_status and len(new_status['shuffle']) > 0:
-            return bool(new_status['shuffle'])
-        return False
+        return new_status.get('shuffle') == 'true'
 
     def get_Volume(self, new_status):
         """returns the volume level"""
@@ -475,59 +607,73 @@ class CmusSoundMenu(dbus.service.Object):
             return ''
         if 'position' in new_status and len(new_status['position']) > 0:
             return dbus.Int32(int(new_status['position']) * 1000)
-        else:
-            self.get_status()
-            if 'position' in new_status and len(new_status['position']) > 0:
-                return int(new_status['position']) * 1000
+        return dbus.Int32(0)
 
     # --- set player interface property
 
     def set_LoopStatus(self, value):
-        """sets the current loop / repeat status"""
+        """
+        sets the current loop / repeat status,
+        returns the applied status or None,
+        the status is updated as cmus will report it
+        """
         if self.status is None:
             return
         if value == 'None':
-            self.cmus_command('-C "set continue=false"')
+            self.cmus_command_async(['-C', 'set continue=false'])
+            self.status['continue'] = 'false'
         elif value == 'Track':
-            self.cmus_command('-C "set continue=true"')
-            self.cmus_command('-C "set repeat_current=true"')
+            self.cmus_command_async(['-C', 'set continue=true',
+                                     'set repeat_current=true'])
+            self.status['continue'] = 'true'
+            self.status['repeat_current'] = 'true'
         elif value == 'Playlist':
-            self.cmus_command('-C "set continue=true"')
-            self.cmus_command('-C "set repeat_current=false"')
-            self.cmus_command('-C "set repeat=true"')
+            self.cmus_command_async(['-C', 'set continue=true',
+                                     'set repeat_current=false',
+                                     'set repeat=true'])
+            self.status['continue'] = 'true'
+            self.status['repeat_current'] = 'false'
+            self.status['repeat'] = 'true'
+        else:
+            return
+        return value
 
     def set_Shuffle(self, value):
-        """sets the current shuffle status"""
+        """
+        sets the current shuffle status,
+        returns the applied status or None
+        """
         if self.status is None:
             return
-        if value == 'True':
-            self.cmus_command('-C "set shuffle=true"')
-        elif value == 'False':
-            self.cmus_command('-C "set shuffle=false"')
+        shuffle = bool(value)
+        if shuffle:
+            self.cmus_command_async(['-C', 'set shuffle=true'])
+            self.status['shuffle'] = 'true'
+        else:
+            self.cmus_command_async(['-C', 'set shuffle=false'])
+            self.status['shuffle'] = 'false'
+        return shuffle
 
     def set_Volume(self, value):
-        """sets the volume level"""
+        """
+        sets the volume level,
+        returns the applied level or None
+        """
         if self.status is None:
             return
-        value = int(value)
-        if value is None:
-            return
-        elif value < 0:
-            self.cmus_command('-v 0%')
-        elif value > 1:
-            self.cmus_command('-v 100%')
-        elif 0 <= value <= 1:
-            self.cmus_command('-v %d%' % value)
+        # cmus keeps the volume within 0-100%
+        volume = min(max(float(value), 0.0), 1.0)
+        percent = int(round(volume * 100))
+        self.cmus_command_async(['-v', '%d%%' % percent])
+        self.status['vol_left'] = str(percent)
+        self.status['vol_right'] = str(percent)
+        return percent / 100.0
 
     # --- helpers for player interface properties
 
     def encoded_uri(self, uri):
         """transform URI to ID"""
-        # Only A-Za-z0-9_ is allowed, which is 63 chars, so we can't use
-        # base64. Luckily, D-Bus does not limit the length of object paths.
-        # Since base32 pads trailing bytes with "=" chars, we need to replace
-        # them with an allowed character such as "_".
-        return str(base64.b32encode(uri.encode('utf-8'))).replace('=', '_')
+        return _encode_uri(uri)
 
     def get_track_id(self, track_path):
         """returns tack ID based on file path and name"""
@@ -560,19 +706,19 @@ class CmusSoundMenu(dbus.service.Object):
     def Next(self):
         """Skips to the next track in the tracklist"""
         logging.debug('%s.Next called', 'org.mpris.MediaPlayer2.Player')
-        self.cmus_command("-n")
+        self.cmus_command_async(['-n'])
 
     @dbus.service.method('org.mpris.MediaPlayer2.Player')
     def Previous(self):
         """Skips to the previous track in the tracklist"""
         logging.debug('%s.Previous called', 'org.mpris.MediaPlayer2.Player')
-        self.cmus_command("-r")
+        self.cmus_command_async(['-r'])
 
     @dbus.service.method('org.mpris.MediaPlayer2.Player')
     def Pause(self):
         """Pauses playback"""
         logging.debug('%s.Pause called', 'org.mpris.MediaPlayer2.Player')
-        self.cmus_command("-u")
+        self.cmus_command_async(['-u'])
 
     @dbus.service.method('org.mpris.MediaPlayer2.Player')
     def PlayPause(self):
@@ -583,21 +729,21 @@ class CmusSoundMenu(dbus.service.Object):
         else:
             playback_value = 'stopped'
         if playback_value in ('paused', 'stopped'):
-            self.cmus_command("-p")
+            self.cmus_command_async(['-p'])
         elif playback_value == 'playing':
-            self.cmus_command("-u")
+            self.cmus_command_async(['-u'])
 
     @dbus.service.method('org.mpris.MediaPlayer2.Player')
     def Stop(self):
         """Stops playback"""
         logging.debug('%s.Stop called', 'org.mpris.MediaPlayer2.Player')
-        self.cmus_command("-s")
+        self.cmus_command_async(['-s'])
 
     @dbus.service.method('org.mpris.MediaPlayer2.Player')
     def Play(self):
         """Starts or resumes playback"""
         logging.debug('%s.Play called', 'org.mpris.MediaPlayer2.Player')
-        self.cmus_command("-p")
+        self.cmus_command_async(['-p'])
 
     @dbus.service.method('org.mpris.MediaPlayer2.Player')
     def Seek(self, offset):
@@ -606,29 +752,33 @@ class CmusSoundMenu(dbus.service.Object):
         by the specified number of microseconds
         """
         logging.debug('%s.Seek called', 'org.mpris.MediaPlayer2.Player')
-        self.cmus_command("-k %+d" % (int(offset) // 1000))
+        # cmus-remote seeks in seconds
+        self.cmus_command_async(['-k', '%+d' % (int(offset) // 1000000)])
 
     @dbus.service.method('org.mpris.MediaPlayer2.Player')
     def SetPosition(self, track_id, position):
         """Sets the current track position in microseconds"""
         logging.debug('%s.SetPosition called', 'org.mpris.MediaPlayer2.Player')
-        position = position // 1000
+        # cmus-remote seeks and reports the duration in seconds
+        position = int(position) // 1000000
         if self.status is None:
             return
         if track_id != self.get_track_id(self.status['file']):
             return
         if position < 0:
             return
-        if position > self.status['duration']:
+        if self.status['duration'] == '':
+            return
+        if position > int(self.status['duration']):
             return
-        self.cmus_command("-k %d" % (int(position)))
+        self.cmus_command_async(['-k', '%d' % position])
 
     @dbus.service.method('org.mpris.MediaPlayer2.Player')
     def OpenUri(self, uri):
         """Opens the Uri given as an argument"""
         logging.debug('%s.OpenUri called', 'org.mpris.MediaPlayer2.Player')
-        self.cmus_command("-c -q %s" % uri)
-        self.cmus_command("-n")
+        self.cmus_command(['-c', '-q', uri])
+        self.cmus_command_async(['-n'])
 
     # --- Player interface signals
 
@@ -641,38 +791,36 @@ class CmusSoundMenu(dbus.service.Object):
 
     def get_embedded_cover(self, filepath):
         """extracts cover image from audio file"""
-        # finds the audio file
+        if '://' in filepath:
+            logging.debug("audio file is not a local file")
+            return
+        # finds the audio file, reads only the tags of its format
+        extension = os.path.splitext(filepath)[1].lower()
+        reader, extract_picture = self.TAG_READERS.get(
+            extension, (File, any_picture))
         try:
-            audio_file = File(filepath)
+            audio_file = reader(filepath)
         except Exception:
             logging.debug("audio file is not suitable for image extraction")
             return
         # searching for the text of an image
         try:
-            cover_key = None
-            if 'APIC' in audio_file:
-                cover_key = 'APIC'
-            else:
-                for key in audio_file.keys():
-                    if key.startswith('APIC:'):
-                        cover_key = key
-                        break
-            if cover_key is not None:
-                apic = audio_file.get(cover_key)
+            data = extract_picture(audio_file)
+            if data is not None:
                 logging.debug("found an embedded image inside audio file")
             else:
                 logging.debug("audio file does not have an embedded image")
                 return
         except Exception as e:
-            logging.debug("error in an embedded image detection: " + str(e))
+            logging.debug("error in an embedded image detection: %s", e)
             return
         # image extraction
         try:
-            artwork = BytesIO(apic.data)
+            artwork = BytesIO(data)
             logging.debug("an embedded image has been extracted")
             return artwork
         except Exception as e:
-            logging.debug("cannot extract an embedded image: " + str(e))
+            logging.debug("cannot extract an embedded image: %s", e)
             return
 
     def get_dir_cover(self, filepath):
@@ -692,32 +840,36 @@ class CmusSoundMenu(dbus.service.Object):
                     "albumart",
                 )
             file_extensions = (".jpg", ".jpeg", ".png")
-            coverfiles = os.listdir(dirpath)
-            coverfiles = filter(lambda x: x.lower().endswith(file_extensions),
-                                coverfiles)
-            coverfiles = list(coverfiles)
-            if len(coverfiles) == 1:
-                cover_names = ('',)
-            coverfiles = filter(lambda x: x.lower().startswith(cover_names),
-                                coverfiles)
-            coverfiles = list(coverfiles)
-            coverfiles.sort(key=lambda x: [x.lower().startswith(i)
-                                           for i in cover_names].index(True))
+            # (priority, name) of every image, the only image in the folder
+            # is accepted whatever its name is
+            no_priority = len(cover_names)
+            coverfiles = []
+            with os.scandir(dirpath) as entries:
+                for entry in entries:
+                    lowered = entry.name.lower()
+                    if not lowered.endswith(file_extensions):
+                        continue
+                    if not entry.is_file():
+                        continue
+                    priority = next((i for i, name in enumerate(cover_names)
+                                     if lowered.startswith(name)),
+                                    no_priority)
+                    coverfiles.append((priority, entry.name, entry.path))
+            if len(coverfiles) > 1:
+                coverfiles = [coverfile for coverfile in coverfiles
+                              if coverfile[0] < no_priority]
+            coverfiles.sort()
             coverpath = None
-            for coverfile in coverfiles:
-                coverpath = os.path.join(dirpath, coverfile)
-                if os.path.exists(coverpath):
-                    break
-                else:
-                    coverpath = None
+            if len(coverfiles) > 0:
+                coverpath = coverfiles[0][2]
             if coverpath is not None:
-                logging.debug("found image file: " + coverpath)
+                logging.debug("found image file: %s", coverpath)
                 return coverpath
             else:
                 logging.debug("cover image file not found")
                 return
         except Exception as e:
-            logging.debug("cannot find image file: " + str(e))
+            logging.debug("cannot find image file: %s", e)
             return
 
     def get_cover(self, new_status):
@@ -731,6 +883,19 @@ class CmusSoundMenu(dbus.service.Object):
         if new_status['file'] == '':
             return
         filepath = new_status['file']
+        try:
+            key = (filepath, os.path.getmtime(filepath))
+        except (OSError, ValueError):
+            key = None
+        if key is not None and key in self._cover_cache:
+            logging.debug("cover image found in cache")
+            self._cover_cache.move_to_end(key)
+            try:
+                self.write_cover(self._cover_cache[key])
+            except Exception as e:
+                logging.debug("cannot write cover image: %s", e)
+                return
+            return self.tempimage.name
         artwork = self.get_embedded_cover(filepath)
         if artwork is None:
             artwork = self.get_dir_cover(filepath)
@@ -739,63 +904,62 @@ class CmusSoundMenu(dbus.service.Object):
             return
         try:
             pic = Image.open(artwork)
-            pic = pic.resize((128, 128))
-            pic.save(self.tempimage, format="PNG")
-            pic.seek(0)
-            self.tempimage.seek(0)
+            pic.draft('RGB', (128, 128))
+            pic.thumbnail((128, 128), Image.BILINEAR)
+            if pic.mode != 'RGB':
+                pic = pic.convert('RGB')
+            thumbnail = BytesIO()
+            pic.save(thumbnail, format="JPEG", quality=85)
             try:
                 artwork.close()
             except AttributeError:
                 pass
-            return self.tempimage.name
+            data = thumbnail.getvalue()
+            self.write_cover(data)
         except Exception as e:
-            logging.debug("cannot process cover image: " + str(e))
+            logging.debug("cannot process cover image: %s", e)
+            return
+        if key is not None:
+            self._cover_cache[key] = data
+            if len(self._cover_cache) > self.COVER_CACHE_SIZE:
+                self._cover_cache.popitem(last=False)
+        return self.tempimage.name
+
+    def write_cover(self, data):
+        """writes encoded cover image to the temporary file"""
+        # tracks of the same album usually share the cover
+        digest = hashlib.sha1(data).digest()
+        if digest == self._cover_digest:
+            logging.debug("cover image is already written")
             return
+        if self.tempimage is None:
+            self.tempimage = NamedTemporaryFile(suffix='.jpg')
+        self.tempimage.seek(0)
+        self.tempimage.truncate()
+        self.tempimage.write(data)
+        self.tempimage.flush()
+        self.tempimage.seek(0)
+        self._cover_digest = digest
 
     # --- Desktop notifications
 
     def show_notification(self, new_status):
         """shows desktop notification with a new status"""
-        if not NOTIFICATIONS_ENABLE:
+        if self._notification is None or new_status is None:
             return
         try:
-            if 'title' in new_status:
-                header = new_status['title']
-            else:
-                header = ''
-            if 'artist' in new_status:
-                msg_artist = new_status['artist']
-            else:
-                msg_artist = ''
-            if 'album' in new_status:
-                msg_album = new_status['album']
-            else:
-                msg_album = ''
-            if 'cover' in new_status:
-                msg_image = new_status['cover']
-            else:
-                msg_image = None
-            message = msg_artist + '\n' + msg_album
-            html_escape_table = {
-                "&": "&amp;",
-                '"': "&quot;",
-                "'": "&#39;",
-                ">": "&gt;",
-                "<": "&lt;",
-                "/": "&#47;",
-            }
-            message = "".join(html_escape_table.get(c, c) for c in message)
+            header = new_status.get('title', '')
+            msg_artist = new_status.get('artist', '')
+            msg_album = new_status.get('album', '')
+            msg_image = new_status.get('cover')
+            message = '\n'.join((msg_artist, msg_album))
+            if MARKUP_CHARS.search(message):
+                message = html.escape(message)
             if header != '':
-                notification = Notify.Notification.new(
-                    header,
-                    message,
-                    msg_image,
-                )
-                notification.set_urgency(0)
-                notification.set_timeout(3000)
-                notification.show()
-        except Exception as e:
-            logging.debug("desktop notofication failed: " + str(e))
+                self._notification.update(header, message, msg_image)
+                self._notification.show()
+        except (GLib.Error, dbus.exceptions.DBusException) as e:
+            logging.debug("desktop notification failed: %s", e)
 
 
 def another_instance(arg):
@@ -803,43 +967,48 @@ def another_instance(arg):
     DESKTOP_NAME = 'cmus'
     SCRIPT_NAME = DESKTOP_NAME + '.soundmenu'
     bus_str = "org.mpris.MediaPlayer2.%s" % (SCRIPT_NAME)
-    bus = dbus.SessionBus()
     try:
-        programinstance = bus.get_object(bus_str,  '/org/mpris/MediaPlayer2')
-        setstatus = programinstance.get_dbus_method('SetStatus',
-                                                    'org.mpris.MediaPlayer2')
-        setstatus(arg)
+        if another_instance.setstatus is None:
+            if another_instance.bus is None:
+                another_instance.bus = dbus.SessionBus()
+            # SetStatus is called with explicit interface,
+            # so introspection is not needed
+            programinstance = another_instance.bus.get_object(
+                bus_str, '/org/mpris/MediaPlayer2', introspect=False)
+            another_instance.setstatus = programinstance.get_dbus_method(
+                'SetStatus', 'org.mpris.MediaPlayer2')
+        another_instance.setstatus(arg)
         logging.info("Another instance was running and notified.")
         return True
     except dbus.exceptions.DBusException as e:
-        logging.debug('Check for another instance: ' + str(e))
+        logging.debug('Check for another instance: %s', e)
         return False
 
 
-def main():
-    # turn on the dbus mainloop
-    DBusGMainLoop(set_as_default=True)
+# the session bus and SetStatus method, reused between calls
+another_instance.bus = None
+another_instance.setstatus = None
+
 
+def main():
     # receive arguments
-    try:
-        arg_list = []
-        for param, value in zip(sys.argv[1::2], sys.argv[2::2]):
-            arg_list.append(' '.join((param.decode('utf-8'),
-                                      value.decode('utf-8'))))
-        arg = '\n'.join(arg_list)
-    except IndexError:
-        arg = ""
-    except Exception:
-        logging.exception("sys.argv stdin:")
-    # check for another instances
-    if not another_instance(arg):
+    # cmus passes the status as "key value" pairs
+    args = iter(sys.argv[1:])
+    arg = '\n'.join(' '.join(pair) for pair in zip(args, args))
+    # check for another instances,
+    # without a status there is nothing to pass to them
+    if arg == "" or not another_instance(arg):
         # initiate the main loop
-        loop = GObject.MainLoop()
+        loop = GLib.MainLoop()
         # initiate a CmusSoundMenu object
-        cmus_sound_menu = CmusSoundMenu(loop)
+        try:
+            cmus_sound_menu = CmusSoundMenu(loop)
+        except dbus.exceptions.NameExistsException:
+            logging.info("Another instance is already running.")
+            return
         try:
             # synchronization timer
-            GObject.timeout_add(600 * 1000, cmus_sound_menu.get_status)
+            GLib.timeout_add_seconds(600, cmus_sound_menu.sync_status)
             logging.debug("loop starts")
             # start the MainLoop
             loop.run()
@@ -848,6 +1017,10 @@ def main():
             cmus_sound_menu.quit_script()
 
 if __name__ == '__main__':
+    # thread and process details are not used by the log format
+    logging.logThreads = False
+    logging.logProcesses = False
+    logging.logMultiprocessing = False
     logging.basicConfig(
             # filename=os.path.splitext(os.path.abspath(__file__))[0] + ".log",
             # filemode='w',